@@ -1,30 +1,27 @@
+import io
 import sys
 import re
 import numpy as np
 import logging
 
-indent = ['',
-          ' ',
-          '  ',
-          '   ',
-          '    ',
-          '     ',
-          '      ',
-          '       ',
-          '        ',
-          '          ',
-          '           ',
-          '            ',
-          '             ',
-          '              ',
-          '               ',
-          '                ']
+indent = [' ' * i for i in range(64)]
+
+def _indent(level):
+    """Indentation string for the given level, extending the table if needed."""
+    while len(indent) <= level:
+        indent.append(' ' * len(indent))
+    return indent[level]
+
+def _write_raw(out, text, level):
+    """Write pre-formatted text, indenting each line to the given level."""
+    indnt = _indent(level)
+    out.write(indnt + ('\n' + indnt).join(text.split('\n')))
 
 class XMLnode(object):
     """This is a minimal class to allow easy creation of an XML tree
     from Python. It can write XML, but cannot read it."""
 
-    __slots__ = ('_name', '_value', '_attribs', '_children', '_childmap')
+    __slots__ = ('_name', '_value', '_attribs', '_children', '_raw')
 
     def __init__(self, name="--", value = ""):
 
@@ -41,9 +38,9 @@ class XMLnode(object):
         else:
             self._value = value.lstrip()
 
-        self._attribs = {}    # dictionary of attributes
+        self._attribs = None  # dictionary of attributes, created on demand
         self._children = []   # list of child nodes
-        self._childmap = {}   # dictionary of child nodes
+        self._raw = None      # list of pre-formatted text, created on demand
 
 
     def name(self):
@@ -61,23 +58,34 @@ class XMLnode(object):
         # create a new node for the child
         c = XMLnode(name = name, value = value)
 
-        # add it to the list of children, and to the dictionary
-        # of children
+        # add it to the list of children
         self._children.append(c)
-        self._childmap[name] = c
         return c
 
     def addComment(self, comment):
         """Add a comment."""
         self.addChild(name = '_comment_', value = comment)
 
+    def addRaw(self, text):
+        """Add pre-formatted XML text. Each line is written indented to the
+        level of the node's children, keeping any relative indentation.
+        The text is kept apart from the child nodes and is written after
+        them."""
+        if self._raw is None:
+            self._raw = []
+        self._raw.append(text)
+
     def value(self):
         """A string containing the element value."""
         return self._value
 
     def child(self, name=""):
-        """The child node with specified name."""
-        return self._childmap[name]
+        """The child node with specified name. If several children share
+        the name, the last one added is returned."""
+        for c in reversed(self._children):
+            if c._name == name:
+                return c
+        raise KeyError(name)
 
     def children(self):
         """ An iterator over the child nodes """
@@ -86,10 +94,14 @@ class XMLnode(object):
 
     def __getitem__(self, key):
         """Get an attribute using the syntax node[key]"""
+        if self._attribs is None:
+            raise KeyError(key)
         return self._attribs[key]
 
     def __setitem__(self, key, value):
         """Set a new attribute using the syntax node[key] = value."""
+        if self._attribs is None:
+            self._attribs = {}
         self._attribs[key] = value
 
     def __call__(self):
@@ -98,74 +110,86 @@ class XMLnode(object):
 
     def write(self, filename):
         """Write out the XML tree to a file."""
-        s = ['<?xml version="1.0"?>\n']
-        self._write(s, 0)
-        s.append('\n')
         if isinstance(filename, str):
-            with open(filename, 'w') as f:
-                f.write(''.join(s))
+            with open(filename, 'w', buffering=1 << 20) as f:
+                self._write_document(f)
         else:
-            filename.write(''.join(s))
-
-    def write_comment(self, s, level):
-        s.append('\n'+indent[level]+'<!--')
+            self._write_document(filename)
+
+    def tostring(self):
+        """The XML tree as a string."""
+        out = io.StringIO()
+        self._write_document(out)
+        return out.getvalue()
+
+    def _write_document(self, out):
+        """Stream the XML declaration and the tree to the file-like 'out'."""
+        out.write('<?xml version="1.0"?>\n')
+        self._write(out, 0)
+        out.write('\n')
+
+    def write_comment(self, out, level):
+        out.write('\n'+_indent(level)+'<!--')
         value = self._value
         if value:
             if value[0] != ' ':
                 value = ' '+value
             if value[-1] != ' ':
                 value += ' '
-        s.append(value+'-->')
-
-    def write_attribs(self, s):
-        for a in self._attribs:
-            s.append(' '+a+'="'+self._attribs[a]+'"')
-
-    def write_value(self, s, level):
-        indnt = indent[level]
-        vv = self._value.lstrip()
-        ieol = vv.find('\n')
-        if ieol >= 0:
-            while True:
-                ieol = vv.find('\n')
-                if ieol >= 0:
-                    s.extend(('\n  ', indnt, vv[:ieol]))
-                    vv = vv[ieol+1:].lstrip()
-                else:
-                    s.extend(('\n  ',indnt,vv))
-                    break
-        else:
-            s.append(self._value)
+        out.write(value+'-->')
+
+    def write_attribs(self, out):
+        if self._attribs:
+            out.write(''.join([' %s="%s"' % kv for kv in self._attribs.items()]))
 
-    def _write(self, s, level = 0):
-        """Internal method used to write the XML representation of each node."""
+    def write_value(self, out, level):
+        indnt = _indent(level)
+        parts = self._value.lstrip().split('\n')
+        if len(parts) == 1:
+            out.write(parts[0])
+            return
+
+        # blank lines are dropped, except for the trailing one
+        last = len(parts) - 1
+        for i, p in enumerate(parts):
+            p = p.lstrip()
+            if p or i == last:
+                out.write('\n  ' + indnt + p)
+
+    def _write(self, out, level = 0):
+        """Internal method used to write the XML representation of each node
+        to the file-like 'out'."""
         if not self.name:
             return
 
         # handle comments
         if self._name == '_comment_':
-            self.write_comment(s, level)
+            self.write_comment(out, level)
             return
 
-        indnt = indent[level]
+        indnt = _indent(level)
 
         # write the opening tag and attributes
-        s.extend((indnt, '<', self._name))
-        self.write_attribs(s)
+        out.write(indnt + '<' + self._name)
+        self.write_attribs(out)
 
-        if not self._value and not self._children:
-            s.append('/>')
+        if not self._value and not self._children and not self._raw:
+            out.write('/>')
         else:
-            s.append('>')
+            out.write('>')
             if self._value:
-                self.write_value(s, level)
+                self.write_value(out, level)
 
             for c in self._children:
-                s.append('\n')
-                c._write(s, level + 2)
-            if self._children:
-                s.extend(('\n', indnt))
-            s.extend(('</', self._name, '>'))
+                out.write('\n')
+                c._write(out, level + 2)
+            if self._raw:
+                for text in self._raw:
+                    out.write('\n')
+                    _write_raw(out, text, level + 2)
+            if self._children or self._raw:
+                out.write('\n' + indnt)
+            out.write('</' + self._name + '>')
 
 
 _name = 'noname'
@@ -204,19 +228,16 @@ def parse(fp):
     """
     processes = []
     for line in fp:
-        try:
-            key = line.strip()
-            fread = KEYWORDS[key]
+        key = line.strip()
+        fread = KEYWORDS.get(key)
+        if fread is None:
+            continue
 
-            # If the key is not found, we do not reach this line.
-            logging.debug("New process of type '%s'" % key)
+        logging.debug("New process of type '%s'" % key)
 
-            d = fread(fp)
-            d['kind'] = key
-            processes.append(d)
-            
-        except KeyError:
-            pass
+        d = fread(fp)
+        d['kind'] = key
+        processes.append(d)
 
     logging.info("Parsing complete. %d processes read." % len(processes))
 
@@ -224,31 +245,45 @@ def parse(fp):
 
 
 # BOLSIG+'s user guide saye that the separators must consist of at least five dashes
-RE_SEP = re.compile("-----+")
-def _read_until_sep(fp):
-    """ Reads lines from fp until a we find a separator line. """
+RE_SEP = re.compile(r"^\s*-----+")
+def _read_until_sep(fp, strip=True):
+    """ Reads lines from fp until a we find a separator line. Lines are
+    stripped unless strip is False. """
     lines = []
     for line in fp:
-        if RE_SEP.match(line.strip()):
+        if RE_SEP.match(line):
             break
-        lines.append(line.strip())
+        lines.append(line.strip() if strip else line)
 
     return lines
 
 
+def _read_table(fp):
+    """ Reads a numeric table from fp up to the next separator. Rows must all
+    have the same number of columns, at least two: energy and cross section.
+    '#' starts a comment, as in np.loadtxt. """
+    data = np.loadtxt(_read_until_sep(fp, strip=False), ndmin=2)
+    if data.size == 0:
+        return np.empty((0, 2))
+    if data.shape[1] < 2:
+        raise ValueError("Cross-section table has %d column(s), expected at "
+                         "least 2" % data.shape[1])
+    return data
+
+
 def _read_block(fp, has_arg=True):
     """ Reads data of a process, contained in a block. 
     has_arg indicates wether we have to read an argument line"""
-    target = fp.next().strip()
+    target = next(fp).strip()
     if has_arg:
-        arg = fp.next().strip()
+        arg = next(fp).strip()
     else:
         arg = None
 
     comment = "\n".join(_read_until_sep(fp))
 
     logging.debug("Read process '%s'" % target)
-    data = np.loadtxt(_read_until_sep(fp)).tolist()
+    data = _read_table(fp)
 
     return target, arg, data
 
@@ -275,13 +310,11 @@ def _read_excitation(fp):
              product=rhs,
              data=data)
 
-    if '<->' in target.split():
-        threshold, weight_ratio = float(arg.split()[0]), float(arg.split()[1])
-        d['weight_ratio'] = weight_ratio
-    else:
-        threshold = float(arg.split()[0])
+    args = arg.split()
+    if '<->' in target and len(args) > 1:
+        d['weight_ratio'] = float(args[1])
 
-    d['threshold'] = threshold
+    d['threshold'] = float(args[0])
 
     return d
 
@@ -311,40 +344,70 @@ KEYWORDS = {"MOMENTUM": _read_momentum,
             "ATTACHMENT": _read_attachment}
 
 
-def main():
-    with open('Cross section.txt') as fp:
-        processes = parse(fp)
+# Leaf elements of a <process> node, formatted directly from the process
+# dictionary instead of building one XMLnode per element.
+TMPL_INELASTIC = ("<reactants>%(target)s</reactants>\n"
+                  "<products>%(product)s</products>\n"
+                  "<threshold>%(threshold)r</threshold>")
+TMPL_WEIGHT_RATIO = "\n<weight_ratio>%(weight_ratio)r</weight_ratio>"
+TMPL_ELASTIC = ("<reactants>%(target)s</reactants>\n"
+                "<products>%(target)s</products>\n"
+                "<mass_ratio>%(mass_ratio)r</mass_ratio>")
+TMPL_DATA = "\n<data>\n%s  </data>"
+TMPL_DATA_EMPTY = "\n<data/>"
+
+def _format_data(data):
+    """ Formats the energies and cross sections of a table as the indented
+    rows of a <data> element. """
+    return ''.join(['  %10.6E %10.6E \n' % (e, sigma)
+                    for e, sigma in np.asarray(data)[:, :2].tolist()])
+
+#
+# Emitters for each process kind. They take the <process> node and the process
+# dictionary, set any extra attributes, and return the formatted leaf elements.
+#
+def _emit_elastic(r, p):
+    """ Emits a MOMENTUM, ELASTIC or EFFECTIVE process. """
+    return TMPL_ELASTIC % p
+
+def _emit_inelastic(r, p):
+    """ Emits an IONIZATION or ATTACHMENT process. """
+    return TMPL_INELASTIC % p
+
+def _emit_excitation(r, p):
+    """ Emits an EXCITATION process, marking it reversible if it has a
+    weight ratio. """
+    leaves = TMPL_INELASTIC % p
+    if 'weight_ratio' in p:
+        r['reversible'] = 'yes'
+        leaves += TMPL_WEIGHT_RATIO % p
+    return leaves
+
+EMITTERS = {"EXCITATION": _emit_excitation,
+            "IONIZATION": _emit_inelastic,
+            "ATTACHMENT": _emit_inelastic}
+
+
+def _build_tree(processes):
+    """ Builds the CTML tree for a list of processes in dictionary form. """
     x = XMLnode("ctml")
     for i, p in enumerate(processes):
+        kind = p['kind']
         r = x.addChild('process')
         r['id'] = str(i)
-        r['type'] = p['kind']
-        r.addChild(name='reactants',value=p['target'])
-
-        if p['kind'].find("EXCITATION") is not -1:
-            r.addChild(name='products',value=p['product'])
-            r.addChild(name='threshold',value=p['threshold'])
-            if 'weight_ratio' in p:
-                r['reversible'] = 'yes'
-                r.addChild(name='weight_ratio',value=p['weight_ratio'])
-        elif p['kind'].find("IONIZATION") is not -1:
-            r.addChild(name='products',value=p['product'])
-            r.addChild(name='threshold',value=p['threshold'])
-        elif p['kind'].find("ATTACHMENT") is not -1:
-            r.addChild(name='products',value=p['product'])
-            r.addChild(name='threshold',value=p['threshold'])       
-        else:
-            r.addChild(name='products',value=p['target'])
-            r.addChild(name='mass_ratio',value=p['mass_ratio'])
-        data = ''
-        for j in p['data']:
-            data += '%10.6E ' % j[0]
-            data += '%10.6E ' % j[1]
-            data += '\n'
+        r['type'] = kind
+
+        leaves = EMITTERS.get(kind, _emit_elastic)(r, p)
+        data = _format_data(p['data'])
+        r.addRaw(leaves + (TMPL_DATA % data if data else TMPL_DATA_EMPTY))
+
+    return x
 
-        r.addChild(name='data',value=data)
 
-    x.write("lxcat.xml")
+def main():
+    with open('Cross section.txt', buffering=1 << 20) as fp:
+        processes = parse(fp)
+    _build_tree(processes).write("lxcat.xml")
 
 
 if __name__ == "__main__":
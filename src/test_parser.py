@@ -0,0 +1,145 @@
+import io
+import os
+import tempfile
+import unittest
+
+import parser
+
+BLOCKS = """EXCITATION
+N2 -> N2(v1)
+ 0.29
+COMMENT: café Å
+-----
+ 0.29 0.0
+ 1.0 1.5e-21
+-----
+ELASTIC
+N2
+ 1.95e-05
+-----
+ 0.0 1.1e-20
+ 1.0 5.0e-20
+-----
+"""
+
+
+class TestParseInputs(unittest.TestCase):
+    """ parse() must give the same result for real files and StringIO. """
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        with open(self.path, 'w', encoding='latin-1') as f:
+            f.write(BLOCKS)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def assertSameProcesses(self, a, b):
+        self.assertEqual(len(a), len(b))
+        for pa, pb in zip(a, b):
+            self.assertEqual(sorted(pa), sorted(pb))
+            for key in pa:
+                if key == 'data':
+                    self.assertTrue((pa[key] == pb[key]).all())
+                else:
+                    self.assertEqual(pa[key], pb[key])
+
+    def test_encoding(self):
+        with open(self.path, encoding='latin-1') as fp:
+            from_file = parser.parse(fp)
+        from_string = parser.parse(io.StringIO(BLOCKS))
+        self.assertEqual(len(from_file), 2)
+        self.assertSameProcesses(from_file, from_string)
+
+    def test_start_position(self):
+        with open(self.path, encoding='latin-1') as fp:
+            for _ in range(7):
+                fp.readline()
+            from_file = parser.parse(fp)
+            self.assertEqual(fp.read(), '')
+
+        sio = io.StringIO(BLOCKS)
+        for _ in range(7):
+            sio.readline()
+        from_string = parser.parse(sio)
+
+        self.assertEqual([p['kind'] for p in from_file], ['ELASTIC'])
+        self.assertSameProcesses(from_file, from_string)
+
+
+class TestReadTable(unittest.TestCase):
+    """ Cross-section tables keep their row structure. """
+
+    def read(self, text):
+        return parser._read_table(io.StringIO(text + "-----\n"))
+
+    def test_comments(self):
+        data = self.read("# energy  cross section\n 1 2 # note\n 3 4\n")
+        self.assertEqual(data.tolist(), [[1, 2], [3, 4]])
+
+    def test_ragged_rows(self):
+        self.assertRaises(ValueError, self.read, "1 2\n3\n4 5\n6\n")
+        self.assertRaises(ValueError, self.read, "1 2 9\n3 4\n")
+
+    def test_single_column(self):
+        self.assertRaises(ValueError, self.read, "1\n3\n")
+
+    def test_extra_columns(self):
+        data = self.read("1 2 9\n3 4 9\n")
+        self.assertEqual(data[:, :2].tolist(), [[1, 2], [3, 4]])
+
+    def test_empty(self):
+        self.assertEqual(self.read("").shape, (0, 2))
+
+
+def _old_tree(processes):
+    """ The CTML tree as main() built it with one XMLnode per element. """
+    x = parser.XMLnode("ctml")
+    for i, p in enumerate(processes):
+        r = x.addChild('process')
+        r['id'] = str(i)
+        r['type'] = p['kind']
+        r.addChild(name='reactants', value=p['target'])
+        if p['kind'] == 'EXCITATION':
+            r.addChild(name='products', value=p['product'])
+            r.addChild(name='threshold', value=p['threshold'])
+            if 'weight_ratio' in p:
+                r['reversible'] = 'yes'
+                r.addChild(name='weight_ratio', value=p['weight_ratio'])
+        else:
+            r.addChild(name='products', value=p['target'])
+            r.addChild(name='mass_ratio', value=p['mass_ratio'])
+        data = ''
+        for j in p['data']:
+            data += '%10.6E ' % j[0]
+            data += '%10.6E ' % j[1]
+            data += '\n'
+        r.addChild(name='data', value=data)
+    return x
+
+
+class TestBuildTree(unittest.TestCase):
+    """ The templated writer produces the same XML as the node-per-element
+    writer it replaced. """
+
+    def test_same_output(self):
+        processes = parser.parse(io.StringIO(BLOCKS + """EXCITATION
+N2 <-> N2(v2)
+ 0.58 1.0
+-----
+ 0.58 0.0
+-----
+EFFECTIVE
+Ar
+ 1.36e-05
+-----
+-----
+"""))
+        self.assertEqual(processes[-1]['data'].shape, (0, 2))
+        self.assertEqual(parser._build_tree(processes).tostring(),
+                         _old_tree(processes).tostring())
+
+
+if __name__ == '__main__':
+    unittest.main()